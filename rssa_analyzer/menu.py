@@ -23,8 +23,9 @@ This CLI interface however provides an easy entry point to use the tool without
 """
 
 import os
+from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import List, Optional, Tuple
 
 from rssa_analyzer.rssa import RSSA
 
@@ -49,6 +50,18 @@ class Command(Enum):
     END = 'end'
 
 
+@dataclass
+class PlotArgs:
+    """Parameters collected from the user for a plot, shared by the plain and the custom plot commands"""
+    particle: str
+    z_int: int
+    theta_int: int
+    source_intensity: float
+    value_range: Optional[Tuple[float, float]] = None
+    x_range: Optional[Tuple[float, float]] = None
+    z_range: Optional[Tuple[float, float]] = None
+
+
 def clear_screen():
     if os.name == 'nt':
         os.system('cls')
@@ -90,12 +103,12 @@ class Menu:
         if len(self.rssa_list) == 1:
             return 0
 
-        for i in range(len(self.rssa_list)):
-            print(f"[{i}]: {self.rssa_list[i].filename}")
+        for i, rssa in enumerate(self.rssa_list):
+            print(f"[{i}]: {rssa.filename}")
         inp = input(" select the rssa by index: ")
         try:
             idx = int(inp)
-            if idx not in [x for x in range(len(self.rssa_list))]:
+            if idx < 0 or idx >= len(self.rssa_list):
                 print("Index not among possible options...")
                 return self.select_rssa_index()
             return idx
@@ -147,76 +160,73 @@ class Menu:
         rssa = self.rssa_list[idx]
         return self.go_main_menu(rssa.get_info())
 
-    def command_plot(self):
+    @staticmethod
+    def _parse_range(text: str) -> Optional[Tuple[float, float]]:
+        """Parse a 'min, max' pair, returns None if the text is blank or not a valid pair"""
+        try:
+            return float(text.split(',')[0]), float(text.split(',')[1])
+        except (ValueError, IndexError):
+            return None
+
+    def _prompt_plot_args(self, custom: bool = False) -> Optional[PlotArgs]:
+        """Collect the plot parameters from the user, returns None if some mandatory field is invalid.
+        The optional ranges are only asked for when custom is True."""
+        particle = input('Enter the particle type (n, p): ')
+        z_int = input('Enter amount of z ints: ')
+        theta_int = input('Enter amount of theta ints: ')
+        source_intensity = input('Enter source intensity: ')
+        try:
+            args = PlotArgs(particle=particle,
+                            z_int=int(z_int),
+                            theta_int=int(theta_int),
+                            source_intensity=float(source_intensity))
+        except ValueError:
+            return None
+
+        if custom:
+            args.value_range = self._parse_range(input('[Optional - leave blank] Enter value range'
+                                                       ' (e.g.: 1e2, 1e8): '))
+            if args.value_range is None:
+                print("No value range selected")
+            args.x_range = self._parse_range(input('[Optional - leave blank] Enter X axis range'
+                                                   ' (e.g.: -200, 600): '))
+            if args.x_range is None:
+                print("No x range selected")
+            args.z_range = self._parse_range(input('[Optional - leave blank] Enter Z axis range'
+                                                   ' (e.g.: -200, 600): '))
+            if args.z_range is None:
+                print("No z range selected")
+        return args
+
+    def _command_plot_shared(self, custom: bool):
         if len(self.rssa_list) == 0:
             return self.go_main_menu("No RSSA files loaded...")
         idx = self.select_rssa_index()
         rssa = self.rssa_list[idx]
-        surf_type = rssa.type
-        if surf_type == 'cyl':
-            particle = input('Enter the particle type (n, p): ')
-            z_int = input('Enter amount of z ints: ')
-            theta_int = input('Enter amount of theta ints: ')
-            source_intensity = input('Enter source intensity: ')
-            try:
-                rssa.plotter.plot_current_cyl(particle=particle,
-                                              z_int=int(z_int),
-                                              theta_int=int(theta_int),
-                                              source_intensity=float(source_intensity),
-                                              save_as=rssa.filename + 'PLOT')
-            except ValueError:
-                self.go_main_menu("Some parameter introduced was incorrect...")
-            self.go_main_menu()
-        else:
-            self.go_main_menu("The RSSA contains a non cylindrical surface, not implemented yet...")
-            return
+        if rssa.type != 'cyl':
+            return self.go_main_menu("The RSSA contains a non cylindrical surface, not implemented yet...")
+
+        args = self._prompt_plot_args(custom)
+        if args is None:
+            return self.go_main_menu("Some parameter introduced was incorrect...")
+        try:
+            rssa.plotter.plot_current_cyl(particle=args.particle,
+                                          z_int=args.z_int,
+                                          theta_int=args.theta_int,
+                                          source_intensity=args.source_intensity,
+                                          value_range=args.value_range,
+                                          x_range=args.x_range,
+                                          z_range=args.z_range,
+                                          save_as=rssa.filename + 'PLOT')
+        except ValueError:
+            return self.go_main_menu("Some parameter introduced was incorrect...")
+        return self.go_main_menu()
+
+    def command_plot(self):
+        return self._command_plot_shared(custom=False)
 
     def command_custom_plot(self):
-        if len(self.rssa_list) == 0:
-            return self.go_main_menu("No RSSA files loaded...")
-        idx = self.select_rssa_index()
-        rssa = self.rssa_list[idx]
-        surf_type = rssa.type
-        if surf_type == 'cyl':
-            particle = input('Enter the particle type (n, p): ')
-            z_int = input('Enter amount of z ints: ')
-            theta_int = input('Enter amount of theta ints: ')
-            source_intensity = input('Enter source intensity: ')
-            try:
-                value_range = input('[Optional - leave blank] Enter value range (e.g.: 1e2, 1e8): ')
-                value_range = float(value_range.split(',')[0]), float(value_range.split(',')[1])
-            except (ValueError, IndexError):
-                value_range = None
-                print("No value range selected")
-            try:
-                x_range = input('[Optional - leave blank] Enter X axis range (e.g.: -200, 600): ')
-                x_range = float(x_range.split(',')[0]), float(x_range.split(',')[1])
-            except (ValueError, IndexError):
-                x_range = None
-                print("No x range selected")
-            try:
-                z_range = input('[Optional - leave blank] Enter Z axis range (e.g.: -200, 600): ')
-                z_range = float(z_range.split(',')[0]), float(z_range.split(',')[1])
-            except (ValueError, IndexError):
-                z_range = None
-                print("No z range selected")
-            try:
-                rssa.plotter.plot_current_cyl(particle=particle,
-                                              z_int=int(z_int),
-                                              theta_int=int(theta_int),
-                                              source_intensity=float(source_intensity),
-                                              value_range=value_range,
-                                              x_range=x_range,
-                                              z_range=z_range,
-                                              save_as=rssa.filename + 'PLOT')
-            except ValueError:
-                self.go_main_menu("Some parameter introduced was incorrect...")
-            self.go_main_menu()
-        else:
-            self.go_main_menu("The RSSA contains a non cylindrical surface, not implemented yet...")
-            return
-        self.go_main_menu()
-        return
+        return self._command_plot_shared(custom=True)
 
     @staticmethod
     def command_end():
@@ -22,10 +22,25 @@ reader and in the RSSA class in the future if deemed necessary.
 TODO: Take into account the RAM limitation due to very heavy files
 TODO: Implement tests
 """
+import json
+import os
+from functools import cached_property
+from typing import TYPE_CHECKING
+
 import numpy as np
 
-from rssa_analyzer.plotter import Plotter
-from rssa_analyzer.rssa_parser import read_rssa
+from rssa_analyzer.rssa_parser import SURFACE_DTYPE, read_rssa_columns
+
+if TYPE_CHECKING:
+    from rssa_analyzer.plotter import Plotter
+
+# Names of the track columns as stored on the RSSA instance and in the disk cache
+COLUMN_NAMES = ('a', 'b', 'wgt', 'erg', 'tme', 'x', 'y', 'z', 'u', 'v', 'c')
+
+# Bumped whenever the layout or the dtypes of the cached columns change, caches with another version are
+#  rebuilt from the RSSA file. Version 2: the c column is stored as float again, version 1 caches hold it
+#  truncated to integers.
+CACHE_VERSION = 2
 
 
 class RSSA:
@@ -43,26 +58,138 @@ class RSSA:
          niwr,  # Number of cells in RSSA file
          mipts,  # Source particle type
          kjaq,  # Flag for macrobodies surfaces
-         surfaces}
-    self.tracks: np.ndarray
-        each index of the array has 11 values
-       0 a,  # History number of the particle, negative if uncollided
-       1 b,  # Packed variable, the sign is the sign of the third direction cosine, starts with 8 = neutron, 16 = photon
-       2 wgt,
-       3 erg,
-       4 tme,
-       5 x,
-       6 y,
-       7 z,
-       8 u,  # Particle direction cosine with X-axis
-       9 v,  # Particle direction cosine with Y-axis, to calculate w (Z-axis) use the sign from b
-      10 c  # Surface id
+         surfaces,  # Structured array with one row per surface: id, info, type and num_params
+         surface_params}  # One int32 array per surface with its variable-length parameters
+    The 11 values recorded for each track are stored as separate contiguous 1-D arrays (structure of arrays).
+    This way operations on a single quantity like x or wgt read memory sequentially instead of striding
+    through an (N, 11) matrix. The meaning of each value is:
+        a,  # History number of the particle, negative if uncollided
+        b,  # Packed variable, the sign is the sign of the third direction cosine, starts with 8 = neutron,
+            #  16 = photon
+        wgt,
+        erg,
+        tme,
+        x,
+        y,
+        z,
+        u,  # Particle direction cosine with X-axis
+        v,  # Particle direction cosine with Y-axis, to calculate w (Z-axis) use the sign from b
+        c  # Surface id
+
+    By default the float columns are stored as float32, which halves the memory footprint and is plenty of
+    precision for plotting and data analysis. Pass use_float32=False to keep the full float64 precision of
+    the binary file.
+
+    When the columns come from the disk cache they are memory-mapped read-only, so files bigger than the
+    available RAM can still be analyzed: only the pages actually touched by an operation become resident.
     """
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, use_float32: bool = True, use_cache: bool = True):
         self.filename = filename
-        self.parameters, self.tracks = read_rssa(filename)
-        self.plotter = Plotter(self)
+
+        # Opening a multi-Gb RSSA is dominated by the parse, so the unpacked columns are persisted next to
+        #  the source file the first time and reused on later openings as long as the file is unchanged
+        if not (use_cache and self._load_from_cache(use_float32)):
+            self.parameters, tracks = read_rssa_columns(filename)
+
+            # Materialize the parser column views into contiguous arrays, one column at a time
+            float_dtype = np.float32 if use_float32 else np.float64
+            self._a = np.ascontiguousarray(tracks.a, dtype=np.int64)
+            self._b = np.ascontiguousarray(tracks.b, dtype=np.int64)
+            self._wgt = np.ascontiguousarray(tracks.wgt, dtype=float_dtype)
+            self._erg = np.ascontiguousarray(tracks.erg, dtype=float_dtype)
+            self._tme = np.ascontiguousarray(tracks.tme, dtype=float_dtype)
+            self._x = np.ascontiguousarray(tracks.x, dtype=float_dtype)
+            self._y = np.ascontiguousarray(tracks.y, dtype=float_dtype)
+            self._z = np.ascontiguousarray(tracks.z, dtype=float_dtype)
+            self._u = np.ascontiguousarray(tracks.u, dtype=float_dtype)
+            self._v = np.ascontiguousarray(tracks.v, dtype=float_dtype)
+            # c is fractional in real files despite its surface-id description, it must stay a float
+            self._c = np.ascontiguousarray(tracks.c, dtype=float_dtype)
+            del tracks
+
+            if use_cache:
+                self._save_cache(use_float32)
+        return
+
+    @cached_property
+    def plotter(self) -> 'Plotter':
+        # Imported here instead of at module level so that opening a file or reading its info does not pay
+        #  the import cost of matplotlib (and numba if installed), only actual plotting does
+        from rssa_analyzer.plotter import Plotter
+        return Plotter(self)
+
+    @property
+    def _cache_dir(self) -> str:
+        return self.filename + '.cache'
+
+    def _load_from_cache(self, use_float32: bool) -> bool:
+        """Try to populate the instance from the disk cache, returns True on success. The cache is
+        considered stale if the RSSA file size or modification time changed or if it was written with a
+        different float precision."""
+        meta_path = os.path.join(self._cache_dir, 'meta.json')
+        try:
+            with open(meta_path) as infile:
+                meta = json.load(infile)
+        except (OSError, ValueError):
+            return False
+
+        try:
+            if meta['version'] != CACHE_VERSION \
+                    or meta['size'] != os.path.getsize(self.filename) \
+                    or meta['mtime'] != os.path.getmtime(self.filename) \
+                    or meta['float32'] != use_float32:
+                return False
+        except (KeyError, TypeError):
+            # Valid JSON but not the meta layout this version writes, treat it like any other stale cache
+            return False
+
+        try:
+            for name in COLUMN_NAMES:
+                # Memory-map the columns instead of reading them eagerly: only the pages that are actually
+                #  touched become resident, so the RAM footprint is the working set and not the whole file.
+                #  The arrays are read-only, any modification requires an explicit copy.
+                column = np.load(os.path.join(self._cache_dir, name + '.npy'), mmap_mode='r')
+                setattr(self, '_' + name, column)
+        except OSError:
+            return False
+
+        parameters = meta['parameters']
+        try:
+            surfaces = np.empty(len(parameters['surfaces']['id']), dtype=SURFACE_DTYPE)
+            for name in SURFACE_DTYPE.names:
+                surfaces[name] = parameters['surfaces'][name]
+            parameters['surfaces'] = surfaces
+            parameters['surface_params'] = [np.array(params, dtype=np.int32)
+                                            for params in parameters['surface_params']]
+        except (KeyError, TypeError):
+            # Cache written by an older version with a different surfaces layout
+            return False
+        self.parameters = parameters
+        return True
+
+    def _save_cache(self, use_float32: bool):
+        """Persist the unpacked columns and parameters next to the source file, failures to write (e.g. a
+        read-only location) are silently ignored as the cache is only an optimization."""
+        parameters = dict(self.parameters)
+        parameters['surfaces'] = {name: parameters['surfaces'][name].tolist()
+                                  for name in parameters['surfaces'].dtype.names}
+        parameters['surface_params'] = [params.tolist() for params in parameters['surface_params']]
+        parameters = {key: (int(value) if isinstance(value, (np.integer, int)) else value)
+                      for key, value in parameters.items()}
+        meta = {'version': CACHE_VERSION,
+                'size': os.path.getsize(self.filename),
+                'mtime': os.path.getmtime(self.filename),
+                'float32': use_float32,
+                'parameters': parameters}
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            for name in COLUMN_NAMES:
+                np.save(os.path.join(self._cache_dir, name + '.npy'), getattr(self, '_' + name))
+            with open(os.path.join(self._cache_dir, 'meta.json'), 'w') as outfile:
+                json.dump(meta, outfile)
+        except OSError:
+            pass
         return
 
     def __repr__(self):
@@ -75,12 +202,12 @@ class RSSA:
 
         sur_type = self.type
         if sur_type == 'cyl':
-            info += f'The surface type is a cylinder with a radius of {np.linalg.norm([self.x[0], self.y[0]]):.2f}\n'
+            info += f'The surface type is a cylinder with a radius of {self.radius:.2f}\n'
         elif sur_type == 'plane':
             info += f'The surface type is a plane...\n'
 
-        n_tracks = self.tracks[self.mask_neutron_tracks].shape[0]
-        p_tracks = self.tracks[self.mask_photon_tracks].shape[0]
+        n_tracks = self.mask_neutron_tracks.shape[0]
+        p_tracks = self.mask_photon_tracks.shape[0]
         info += f'The total amount of tracks recorded is {self.parameters["nrss"]}, of which {n_tracks} were neutrons' \
                 f' and {p_tracks} were photons.\n'
 
@@ -88,57 +215,84 @@ class RSSA:
                 f'The amount of independent histories that reached the RSSA surfaces was {self.parameters["niss"]}.\n'
         return info
 
-    @property
+    # The track data never changes once loaded, so the masks and the surface type are computed once on first
+    #  access and cached for the rest of the life of the instance
+    @cached_property
+    def _bool_mask_neutron(self) -> np.ndarray:
+        particle_codes = np.abs(self._b)  # Get all the bitarrays and don't pay attention to the sign
+        # The bitarray is the particle code followed by 8 more digits, 8 = neutron and 16 = photon, so an
+        #  integer division recovers the code exactly without any float comparison
+        particle_codes //= 100_000_000
+        return particle_codes == 8
+
+    @cached_property
     def mask_neutron_tracks(self) -> np.ndarray:
-        bitarrays = np.abs(self.tracks[:, 1])  # Get all the bitarrays and don't pay attention to the sign
-        n_tracks = np.where(bitarrays < 9e8)[0]  # Neutrons start with 8 and photons with 16 followed by 1e8
-        return n_tracks
+        return np.where(self._bool_mask_neutron)[0]
 
-    @property
+    @cached_property
     def mask_photon_tracks(self):
-        bitarrays = np.abs(self.tracks[:, 1])  # Get all the bitarrays and don't pay attention to the sign
-        p_tracks = np.where(bitarrays >= 9e8)[0]  # Neutrons start with 8 and photons with 16 followed by 1e8
-        return p_tracks
+        return np.where(~self._bool_mask_neutron)[0]
 
-    def get_particle_mask(self, particle: str):
+    def get_particle_mask(self, particle: str, as_bool: bool = False):
+        """Return the tracks of the given particle type, as index arrays by default or as a boolean mask
+        with as_bool=True. Boolean masks can be combined with other filters via elementwise AND without the
+        sorting cost of np.intersect1d."""
         if particle == 'n':
-            return self.mask_neutron_tracks
+            return self._bool_mask_neutron if as_bool else self.mask_neutron_tracks
         elif particle == 'p':
-            return self.mask_photon_tracks
+            return ~self._bool_mask_neutron if as_bool else self.mask_photon_tracks
         else:
             raise ValueError(f"Particle was {particle}, not n or p...")
 
+    @cached_property
+    def tracks(self) -> np.ndarray:
+        """The (N, 11) matrix with all the values of all the tracks, in the column order of COLUMN_NAMES.
+        Kept for backwards compatibility with scripts written against the matrix layout: it is assembled
+        from the columns on first access and costs a full extra copy of the data, prefer the column
+        properties like x or wgt for new code."""
+        return np.column_stack([getattr(self, '_' + name) for name in COLUMN_NAMES])
+
     @property
     def x(self) -> np.ndarray:
-        return self.tracks[:, 5]
+        return self._x
 
     @property
     def y(self) -> np.ndarray:
-        return self.tracks[:, 6]
+        return self._y
 
     @property
     def z(self) -> np.ndarray:
-        return self.tracks[:, 7]
+        return self._z
 
     @property
     def wgt(self) -> np.ndarray:
-        return self.tracks[:, 2]
+        return self._wgt
 
     @property
     def energies(self) -> np.ndarray:
-        return self.tracks[:, 3]
+        return self._erg
 
     @property
     def histories(self) -> np.ndarray:
-        return np.abs(self.tracks[:, 0])
+        return np.abs(self._a)
 
-    @property
+    @cached_property
+    def radius(self) -> float:
+        """Distance of the first track to the Z axis, which is the radius of the cylinder for cylindrical
+        RSSA files"""
+        return float(np.hypot(self._x[0], self._y[0]))
+
+    @cached_property
     def type(self):
         # If there are more than 1 surface we cannot say if it is a cyl or a plane
         if len(self.parameters['surfaces']) > 1:
             return 'multiple'
-        # Assume it is a cyl and calculate the radius of its tracks, if they are different it is a plane
-        radius = np.sqrt(self.x ** 2 + self.y ** 2)
+        # Assume it is a cyl and calculate the radius of its tracks, if they are different it is a plane.
+        # A random sample of 10k tracks is plenty to tell the two cases apart, there is no need to check
+        #  every track of a multi-Gb file, and np.hypot avoids the temporaries of sqrt(x**2 + y**2)
+        n_tracks = self._x.shape[0]
+        sample = np.random.default_rng(0).choice(n_tracks, size=min(n_tracks, 10_000), replace=False)
+        radius = np.hypot(self._x[sample], self._y[sample])
         if np.std(radius) < 1e-4:
             return 'cyl'
         else:
@@ -25,38 +25,95 @@ D1SUNED3.1.4.
 This reader loads into memory the entirety of the RSSA binary file, for very heavy RSSAs we can encounter RAM
 problems. This problem can be mitigated in future versions of the software.
 
+Repeated reads of the same file within an analysis pipeline are served by the OS page cache: the track
+payload is memory-mapped, so a second read_rssa of a file reuses the already-faulted pages instead of
+allocating and zeroing a fresh multi-Gb buffer. A userspace buffer pool on top of the numpy allocator was
+considered and discarded, the PyDataMem hooks it needs are only reachable from C and the page cache
+already covers the reuse case. A compiled (Cython) record decoder was discarded for the same kind of
+reason: the structured record dtype turns the decode into a plain typed view of the raw buffer, there is
+no per-record Python work left for a C loop to remove and it would cost this package its pure-Python
+install.
+
 TODO: Mitigate the RAM limitation problems
 TODO: Add the ability to read the headers of more MCNP versions
 """
+import mmap
+import os
+import queue
+import struct
+import threading
+from collections import namedtuple
 from typing import BinaryIO, Dict
 
 import numpy as np
 
 FILE_NAME = '../tests/data/E-Lite_IVVS_v5.5.w'
+# The RSSA files are little-endian, the dtypes are pinned explicitly so the parser reads them correctly
+#  on big-endian hosts too instead of inheriting the native byte order
 BYTE = np.byte
 CHAR = np.char
-INT = np.int32
-FLOAT = np.float64
-LONG = np.int64
+INT = np.dtype('<i4')
+FLOAT = np.dtype('<f8')
+LONG = np.dtype('<i8')
+
+# Names of the 11 values recorded per particle, in the order they appear in the record
+TRACK_FIELDS = ('a', 'b', 'wgt', 'erg', 'tme', 'x', 'y', 'z', 'u', 'v', 'c')
+
+# Layout of one particle record: the 11 float64 values framed by the two int32 Fortran record markers,
+#  96 bytes in total. The itemsize covers the whole record while the fields start at offset 4, so the
+#  markers are stepped over without ever being materialized and reading with this dtype needs none of the
+#  reshape/slice/copy gymnastics. The vals field exposes the whole (N, 11) matrix while the named fields
+#  overlap it so each value is also addressable as a column, e.g. records['x'].
+TRACK_DTYPE = np.dtype({'names': ['vals'] + list(TRACK_FIELDS),
+                        'formats': [(FLOAT, (11,))] + [FLOAT] * len(TRACK_FIELDS),
+                        'offsets': [4] + [4 + 8 * i for i in range(len(TRACK_FIELDS))],
+                        'itemsize': 96})
+
+# Column-wise (structure of arrays) view of the tracks as returned by read_rssa_columns
+Tracks = namedtuple('Tracks', TRACK_FIELDS)
 
+# Size of the blocks used when bulk-reading the track payload
+READ_BLOCK_SIZE = 16 * 1024 * 1024
 
-def read_fortran_record(file: BinaryIO):
-    count_1 = np.fromfile(file, INT, 1)[0]
-    data = np.fromfile(file, np.byte, count_1)
-    count_2 = np.fromfile(file, INT, 1)[0]
+# Precompiled unpackers for the scalar fields of the header records: unpacking a handful of ints with a
+#  struct.Struct is much faster than going through numpy, which pays dtype dispatch on every tiny read.
+#  _S_HEADER2 covers np1, nrss, nrcd, njsw and niss; _S_INT3 the third record; _S_SURFACE_HEAD the four
+#  fixed ints at the start of each surface record.
+_S_HEADER2 = struct.Struct('<qqiiq')
+_S_INT3 = struct.Struct('<3i')
+_S_SURFACE_HEAD = struct.Struct('<4i')
+
+# Layout of the fixed surface fields as stored in the surfaces structured array of the parameters. The
+#  params of each surface have a variable length, they live in the parallel surface_params list instead.
+SURFACE_DTYPE = np.dtype([('id', INT), ('info', INT), ('type', INT), ('num_params', INT)])
+
+
+def read_fortran_record(file: BinaryIO) -> bytes:
+    # The records of the header are tiny, plain reads and int.from_bytes on the markers are faster than
+    #  building one-element ndarrays with np.fromfile just to compare two int32s
+    count_1 = int.from_bytes(file.read(4), 'little')
+    data = file.read(count_1)
+    count_2 = int.from_bytes(file.read(4), 'little')
     if count_1 != count_2:
         raise ValueError("The integers that go before and after the Fortran record are not equal...")
     return data
 
 
+def _parse_surface(data, kjaq: int):
+    surface_id, info, surface_type, num_params = _S_SURFACE_HEAD.unpack_from(data)
+    # The info field is only recorded for macrobody surfaces
+    head = (surface_id, info if kjaq == 1 else -1, surface_type, num_params)
+    return head, np.frombuffer(data, INT, offset=16)
+
+
 def read_header(file: BinaryIO) -> Dict:
     # First record
     data = read_fortran_record(file)
     # The first line of the file with information like the code version, date and title
-    format_record_id = data.tobytes().decode('UTF-8')
+    format_record_id = data.decode('UTF-8')
     if 'd1suned' in format_record_id:
         # TODO: we could parse and store information like datetime and title
-        _last_dump = np.frombuffer(data[-4:], INT)
+        _last_dump = int.from_bytes(data[-4:], 'little')
         pass
     else:
         raise NotImplementedError(f'The code that generated this RSSA file has not been implemented'
@@ -64,34 +121,45 @@ def read_header(file: BinaryIO) -> Dict:
 
     # Second record
     data = read_fortran_record(file)
-    np1 = np.frombuffer(data, LONG, 1, 0)[0]
-    nrss = np.frombuffer(data, LONG, 1, 8)[0]
-    nrcd = np.frombuffer(data, INT, 1, 16)[0]
-    njsw = np.frombuffer(data, INT, 1, 20)[0]
-    niss = np.frombuffer(data, LONG, 1, 24)[0]
+    np1, nrss, nrcd, njsw, niss = _S_HEADER2.unpack_from(data)
     if nrcd != 11:
         raise NotImplementedError(f"The amount of values recorded for each particle should be 11 instead of {nrcd}...")
 
     # Third record
-    if np1 < 0:
-        data = read_fortran_record(file)
-        niwr, mipts, kjaq = np.frombuffer(data, INT, 3)
-    else:
+    # np1 is always negative in the files this parser understands, check it once and keep the record read
+    #  itself unconditional so the header path is a straight sequence of reads
+    if np1 >= 0:
         raise NotImplementedError("The np1 value is not negative, as far as we understand it should be negative...")
+    data = read_fortran_record(file)
+    niwr, mipts, kjaq = _S_INT3.unpack_from(data)
 
     # Fourth record
-    surfaces = []
-    for i in range(njsw):
+    # The fixed surface fields go into a structured array so consumers can vectorize queries like
+    #  surfaces['type'] == X; the variable-length params stay in the parallel surface_params list
+    surfaces = np.empty(njsw, dtype=SURFACE_DTYPE)
+    surface_params = []
+    if njsw > 0:
+        # Surface records usually all share the same length, in that case the remaining ones are read with
+        #  a single bulk request instead of one Fortran-record read (and its marker checks) per surface
         data = read_fortran_record(file)
-        surface = {'id': np.frombuffer(data, INT, 1, 0)[0]}
-        if kjaq == 1:
-            surface['info'] = np.frombuffer(data, INT, 1, 4)[0]
-        else:
-            surface['info'] = -1
-        surface['type'] = np.frombuffer(data, INT, 1, 8)[0]
-        surface['num_params'] = np.frombuffer(data, INT, 1, 12)[0]
-        surface['params'] = np.frombuffer(data, INT, offset=16)
-        surfaces.append(surface)
+        surfaces[0], params = _parse_surface(data, kjaq)
+        surface_params.append(params)
+        record_length = len(data)
+        if njsw > 1:
+            loop_start = file.tell()
+            bulk_dtype = np.dtype([('_head', INT), ('data', BYTE, (record_length,)), ('_tail', INT)])
+            batch = np.fromfile(file, bulk_dtype, count=njsw - 1)
+            if batch.shape[0] == njsw - 1 \
+                    and np.all(batch['_head'] == record_length) and np.all(batch['_tail'] == record_length):
+                for i, row in enumerate(batch['data'], start=1):
+                    surfaces[i], params = _parse_surface(row, kjaq)
+                    surface_params.append(params)
+            else:
+                # The records have different lengths, go back and read them one by one
+                file.seek(loop_start)
+                for i in range(1, njsw):
+                    surfaces[i], params = _parse_surface(read_fortran_record(file), kjaq)
+                    surface_params.append(params)
 
     # we read any extra records as determined by njsw+niwr...
     # no known case of their actual utility is known currently
@@ -111,35 +179,148 @@ def read_header(file: BinaryIO) -> Dict:
                   'niwr': niwr,  # Number of cells in RSSA file
                   'mipts': mipts,  # Source particle type
                   'kjaq': kjaq,  # Flag for macrobodies surfaces
-                  'surfaces': surfaces}
+                  'surfaces': surfaces,  # Structured array with the id, info, type and num_params fields
+                  'surface_params': surface_params}  # One int32 array per surface, lengths may differ
     return parameters
 
 
-def read_tracks(file: BinaryIO) -> np.ndarray:
+def _read_track_records(file: BinaryIO, n_records: int = None) -> np.ndarray:
+    """Read all the particle records of the file as a structured TRACK_DTYPE array.
+
+    The amount of records is usually known beforehand as the nrss header field; when it is not given it is
+    derived from the remaining bytes of the file.
+    """
     # Particle records
-    # Read the whole remaining of the file at once, store all the bytes as a 1D numpy array
-    data = np.fromfile(file, BYTE)
-    # Reshape the array so each index holds the information of a single particle, we can do this because we
-    #  know that the particle records have always the same length, 96 bytes
-    data = data.reshape(-1, 96)
-    # Remove the first and last 4 bytes, these are two integers that tell the record is 88 bytes long
-    data = data[:, 4:-4]
-    # Convert the array into a 1D array of float numbers instead of simply bytes
-    data = np.frombuffer(data.flatten(), FLOAT)
-    # Reshape the array so each index holds the information of a single particle, all the data is already converted
-    #  from bytes to floats
-    data = data.reshape(-1, 11)
-    return data
+    # The records are structured 96-byte entries, each holding the 11 values of a single particle between
+    #  the two Fortran record markers. The record buffer is allocated once, sized exactly, and filled with
+    #  large batched reads straight into it: no growable intermediate buffer and no extra userspace copy.
+    if n_records is None:
+        offset = file.tell()
+        file_size = file.seek(0, 2)
+        file.seek(offset)
+        n_records = (file_size - offset) // TRACK_DTYPE.itemsize
+
+    # The buffer is allocated as raw bytes and only viewed with the record dtype at the end: arrays with
+    #  overlapping fields cannot expose a writable memoryview for readinto
+    buffer = np.empty(n_records * TRACK_DTYPE.itemsize, dtype=np.uint8)
+    view = memoryview(buffer)
+    read_bytes = 0
+    while read_bytes < len(view):
+        # 16 Mb blocks are large enough to run the disk at full bandwidth while keeping the kernel
+        #  readahead busy with the next block
+        count = file.readinto(view[read_bytes:read_bytes + READ_BLOCK_SIZE])
+        if not count:
+            raise ValueError("The RSSA file ended before all the expected particle records were read...")
+        read_bytes += count
+    return buffer.view(TRACK_DTYPE)
 
 
-def read_rssa(filename: str):
+def read_tracks(file: BinaryIO, dtype=FLOAT) -> np.ndarray:
+    """Read all the particle records of the file, returns an (N, 11) array of the given dtype.
+
+    The file stores float64; passing dtype=np.float32 halves the memory footprint and the bandwidth of
+    every later pass over the tracks, plenty of precision for tallies, histograms and plots. With the
+    default float64 the returned array is a view into the raw record buffer, not a fresh copy: callers
+    that need an independent or C-contiguous array should pass it through np.ascontiguousarray once at
+    their boundary.
+    """
+    # Selecting the vals field gives the (N, 11) float matrix as a view, no byte is copied or reparsed
+    return _read_track_records(file)['vals'].astype(dtype, copy=False)
+
+
+def iter_tracks(filename: str, chunk_size: int = 1 << 20):
+    """Yield the particle records of the file as successive (chunk_size, 11) float64 arrays.
+
+    Consumers that accumulate or filter chunk by chunk keep their peak RAM bounded by the chunk size
+    instead of the file size, which makes it possible to stream files much bigger than the available
+    memory. The chunks are read by a background thread that stays one chunk ahead of the caller, so the
+    file I/O of the next chunk overlaps with whatever work the consumer does on the current one and the
+    wall time approaches max(read, process) instead of their sum.
+    """
+    with open(filename, 'rb') as infile:
+        if hasattr(os, 'posix_fadvise'):  # Not available on Windows
+            os.posix_fadvise(infile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        read_header(infile)
+
+        stop = threading.Event()
+        chunks: queue.Queue = queue.Queue(maxsize=1)
+
+        def producer():
+            try:
+                while not stop.is_set():
+                    records = np.fromfile(infile, TRACK_DTYPE, count=chunk_size)
+                    chunks.put(records)
+                    if records.shape[0] < chunk_size:  # The last chunk of the file has been read
+                        return
+            except Exception as error:
+                chunks.put(error)  # Delivered to the consumer on its next get
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = chunks.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item.shape[0] == 0:
+                    return
+                yield item['vals']
+                if item.shape[0] < chunk_size:
+                    return
+        finally:
+            # Unblock the producer if the consumer abandoned the iteration early, then wait for it so the
+            #  file is not closed under an in-flight read
+            stop.set()
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                pass
+            thread.join()
+
+
+def _read_rssa_records(filename: str):
     with open(filename, 'rb') as infile:
         # This parameters hold information like the amount of histories or the amount of tracks recorded
         parameters = read_header(infile)
+        header_end = infile.tell()
+
+    try:
+        # Memory-map the track payload instead of reading it eagerly: the OS pages the records in on
+        #  demand, so opening the file does not allocate the whole payload in RAM. Giving the shape from
+        #  the nrss header field makes the map fail loudly on truncated files instead of silently mapping
+        #  fewer records.
+        records = np.memmap(filename, dtype=TRACK_DTYPE, mode='r', offset=header_end,
+                            shape=(parameters['nrss'],))
+        raw_mmap = getattr(records, '_mmap', None)
+        if raw_mmap is not None and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            raw_mmap.madvise(mmap.MADV_SEQUENTIAL)  # The records are consumed in order, widen readahead
+    except (OSError, ValueError):
+        # Fall back to the eager read, e.g. for filesystems that cannot be memory-mapped
+        with open(filename, 'rb') as infile:
+            if hasattr(os, 'posix_fadvise'):  # Not available on Windows
+                # The payload is consumed strictly in order: advising the kernel widens its readahead
+                #  window and starts prefetching the tracks while the buffer is still being allocated
+                os.posix_fadvise(infile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(infile.fileno(), header_end, 0, os.POSIX_FADV_WILLNEED)
+            infile.seek(header_end)
+            records = _read_track_records(infile, parameters['nrss'])
+
+    return parameters, records
+
+
+def read_rssa(filename: str, dtype=FLOAT):
+    # astype with copy=False is a no-op for the default float64, the tracks stay a view of the records
+    parameters, records = _read_rssa_records(filename)
+    return parameters, records['vals'].astype(dtype, copy=False)
 
-        tracks = read_tracks(infile)
 
-    return parameters, tracks
+def read_rssa_columns(filename: str, dtype=FLOAT):
+    """Like read_rssa but the tracks are returned as a Tracks namedtuple of eleven length-N columns, one
+    per recorded value. Consumers that work value by value (like the RSSA class) avoid striding through
+    the (N, 11) matrix; with the default float64 each column is still a view, materialize one at a time
+    for contiguity. A dtype of np.float32 downcasts the columns, halving their memory footprint."""
+    parameters, records = _read_rssa_records(filename)
+    return parameters, Tracks(*(records[field].astype(dtype, copy=False) for field in TRACK_FIELDS))
 
 
 if __name__ == '__main__':
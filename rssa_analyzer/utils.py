@@ -1,11 +1,18 @@
-import time
-from typing import Callable
-
-
-def measure_time(func: Callable):
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        func(*args, **kwargs)
-        print(time.time() - start_time)
-
-    return wrapper
+import time
+from functools import wraps
+from typing import Callable
+
+
+def measure_time(func: Callable):
+    """Decorator that measures the duration of each call with the monotonic ns-resolution performance
+    counter. The wrapped function returns (result, elapsed_ns) so the measurement can be consumed
+    programmatically by benchmarks instead of only printed."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter_ns() - start
+        print(f'{func.__name__} took {elapsed / 1e9:.3f}s')
+        return result, elapsed
+
+    return wrapper
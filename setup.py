@@ -22,12 +22,13 @@ setup(
     keywords='MCNP, radiation, RSSA, SSW, SSR',
 
     packages=['rssa_analyzer'],  # Required
-    python_requires='>=3.7',
+    python_requires='>=3.8',  # functools.cached_property and mmap.madvise appeared in 3.8
 
     install_requires=['numpy',
                       'matplotlib'],
     extras_require={
         'test': ['unittest'],
+        'fast': ['numba>=0.57'],  # JIT-compiled hot loops in the plotter, pure numpy fallback without it
     },
 
     entry_points={